@@ -0,0 +1,243 @@
+import os
+import threading
+import numpy as np
+from typing import List
+from langchain_core.documents import Document
+
+# Chroma's values for collections created without HNSW metadata (e.g. the original "langchain" collection)
+CHROMA_HNSW_DEFAULTS = {"hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10}
+
+# Rows per block when encoding or scoring int8 vectors, so no full float32 copy is ever materialized
+_BLOCK_ROWS = 4096
+
+
+class AnnConfig:
+    """ANN settings, read from environment variables"""
+
+    def __init__(self):
+        # "auto": exact NumPy search for small collections, Chroma's HNSW index above the threshold
+        # "hnsw": always use Chroma's HNSW index
+        # "exact": always use the in-process NumPy index (combine with int8 to save memory)
+        self.backend = os.getenv("ANN_BACKEND", "auto").lower()
+        self.m = int(os.getenv("ANN_HNSW_M", "16"))
+        self.ef_construction = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "100"))
+        self.ef_search = int(os.getenv("ANN_HNSW_EF_SEARCH", "100"))
+        self.quantization = os.getenv("ANN_QUANTIZATION", "none").lower()
+        self.exact_threshold = int(os.getenv("ANN_EXACT_THRESHOLD", "20000"))
+
+        if self.backend not in ("auto", "hnsw", "exact"):
+            raise ValueError(f"Unsupported ANN_BACKEND: {self.backend}")
+        if self.quantization not in ("none", "int8"):
+            raise ValueError(f"Unsupported ANN_QUANTIZATION: {self.quantization}")
+
+    def collection_metadata(self):
+        """HNSW build/search parameters in the form Chroma expects on collection creation"""
+        return {
+            "hnsw:M": self.m,
+            "hnsw:construction_ef": self.ef_construction,
+            "hnsw:search_ef": self.ef_search,
+        }
+
+    def mismatched_params(self, collection_metadata):
+        """(key, configured, in effect) for each HNSW parameter an existing collection was built without"""
+        collection_metadata = collection_metadata or {}
+        mismatches = []
+        for key, configured in self.collection_metadata().items():
+            actual = collection_metadata.get(key, CHROMA_HNSW_DEFAULTS[key])
+            if actual != configured:
+                mismatches.append((key, configured, actual))
+        return mismatches
+
+
+class ExactIndex:
+    """Brute-force cosine search over an in-memory NumPy matrix, optionally int8-quantized"""
+
+    def __init__(self, dimension, quantization="none"):
+        self.dimension = dimension
+        self.quantization = quantization
+        dtype = np.int8 if quantization == "int8" else np.float32
+        self.vectors = np.zeros((0, dimension), dtype=dtype)
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.ids = []
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _encode(self, vectors):
+        """Normalize rows to unit length and quantize them if int8 mode is on"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.quantization != "int8":
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _grow(self, needed):
+        capacity = len(self.vectors)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        vectors = np.zeros((new_capacity, self.dimension), dtype=self.vectors.dtype)
+        vectors[:self.size] = self.vectors[:self.size]
+        scales = np.zeros(new_capacity, dtype=np.float32)
+        scales[:self.size] = self.scales[:self.size]
+        self.vectors, self.scales = vectors, scales
+
+    def add(self, ids, vectors):
+        if not ids:
+            return
+        self._grow(self.size + len(ids))
+        for start in range(0, len(ids), _BLOCK_ROWS):
+            end = min(start + _BLOCK_ROWS, len(ids))
+            encoded, scales = self._encode(vectors[start:end])
+            self.vectors[self.size + start:self.size + end] = encoded
+            self.scales[self.size + start:self.size + end] = scales
+        self.ids.extend(ids)
+        self.size += len(ids)
+
+    def remove(self, ids):
+        remove = set(ids)
+        keep = [i for i, doc_id in enumerate(self.ids) if doc_id not in remove]
+        if len(keep) == self.size:
+            return
+        # Compact into new arrays rather than in place, so snapshots taken by readers stay valid
+        vectors = np.zeros_like(self.vectors)
+        vectors[:len(keep)] = self.vectors[keep]
+        scales = np.zeros_like(self.scales)
+        scales[:len(keep)] = self.scales[keep]
+        self.vectors, self.scales = vectors, scales
+        self.ids = [self.ids[i] for i in keep]
+        self.size = len(keep)
+
+    def snapshot(self):
+        """Read-only view of the current rows that later add/remove calls never modify.
+
+        `add` only writes past `size` (or into freshly grown arrays) and `remove`
+        builds new arrays, so the view can be searched without holding a lock.
+        """
+        view = ExactIndex.__new__(ExactIndex)
+        view.dimension = self.dimension
+        view.quantization = self.quantization
+        view.vectors = self.vectors[:self.size]
+        view.scales = self.scales[:self.size]
+        view.ids = self.ids
+        view.size = self.size
+        return view
+
+    def search(self, query, k):
+        """Return up to k (id, cosine similarity) pairs, best first"""
+        if self.size == 0 or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dimension)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        if self.quantization == "int8":
+            scores = np.empty(self.size, dtype=np.float32)
+            for start in range(0, self.size, _BLOCK_ROWS):
+                end = min(start + _BLOCK_ROWS, self.size)
+                scores[start:end] = (self.vectors[start:end].astype(np.float32) @ query) * self.scales[start:end]
+        else:
+            scores = self.vectors[:self.size] @ query
+
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+    def memory_bytes(self):
+        """Bytes used by the stored vectors (excluding ids)"""
+        return self.size * (self.vectors.itemsize * self.dimension + self.scales.itemsize)
+
+
+class AnnSearcher:
+    """Routes similarity search to an exact NumPy index or to Chroma's HNSW index"""
+
+    def __init__(self, vectorstore, embedding_function, config=None):
+        self.vectorstore = vectorstore
+        self.embedding_function = embedding_function
+        self.config = config or AnnConfig()
+        self.index = None
+        self.lock = threading.Lock()
+
+    def _collection(self):
+        return self.vectorstore._collection
+
+    def use_exact(self):
+        """Decide whether this query should go to the exact index"""
+        if self.config.backend == "exact":
+            return True
+        if self.config.backend == "hnsw":
+            return False
+        return self._collection().count() <= self.config.exact_threshold
+
+    def _load_index(self):
+        """Build the exact index from every embedding stored in Chroma"""
+        data = self._collection().get(include=["embeddings"])
+        embeddings = data.get("embeddings")
+        dimension = getattr(self.embedding_function, "dimension", None)
+        if dimension is None:
+            dimension = len(embeddings[0]) if embeddings is not None and len(embeddings) else 384
+        index = ExactIndex(dimension, self.config.quantization)
+        if data.get("ids"):
+            index.add(list(data["ids"]), embeddings)
+        print(f"Exact ANN index loaded with {len(index)} vectors ({index.memory_bytes() / 1e6:.1f} MB, {self.config.quantization})")
+        return index
+
+    def _ensure_index(self):
+        """Load the exact index if needed; call with self.lock held"""
+        if self.index is None:
+            self.index = self._load_index()
+        return self.index
+
+    def swap(self, vectorstore, embedding_function):
+        """Point the searcher at a new collection; the exact index is rebuilt on next use"""
+        with self.lock:
+            self.vectorstore = vectorstore
+            self.embedding_function = embedding_function
+            self.index = None
+
+    def on_added(self, ids):
+        """Keep an already-loaded exact index in sync with newly indexed chunks"""
+        with self.lock:
+            if self.index is None or not ids:
+                return
+            data = self._collection().get(ids=list(ids), include=["embeddings"])
+            # Chunk ids are deterministic, so a re-added chunk replaces its old row instead of duplicating it
+            self.index.remove(data["ids"])
+            self.index.add(list(data["ids"]), data["embeddings"])
+
+    def on_deleted(self, ids):
+        with self.lock:
+            if self.index is not None:
+                self.index.remove(ids)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        with self.lock:
+            # Snapshot so a concurrent swap() cannot mix two collections within one query
+            vectorstore, embedding_function = self.vectorstore, self.embedding_function
+            index = self._ensure_index().snapshot() if self.use_exact() else None
+        if index is None:
+            return vectorstore.similarity_search(query, k=k)
+
+        # Scoring runs on the snapshot outside the lock, so concurrent queries don't serialize
+        query_embedding = embedding_function.embed_query(query)
+        hits = index.search(query_embedding, k)
+        if not hits:
+            return []
+
+        # Vectors live in the index; text and metadata are fetched from Chroma for the hits only
+        hit_ids = [doc_id for doc_id, _ in hits]
+        data = vectorstore._collection.get(ids=hit_ids, include=["documents", "metadatas"])
+        by_id = {doc_id: (text, metadata) for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])}
+        return [
+            Document(page_content=by_id[doc_id][0], metadata=by_id[doc_id][1] or {})
+            for doc_id in hit_ids
+            if doc_id in by_id
+        ]
@@ -0,0 +1,134 @@
+"""Sweep recall against latency and memory for the exact, int8 and HNSW search backends.
+
+Usage:
+    python benchmarks/ann_bench.py [--sizes 10000,100000,1000000] [--queries 200] [--k 8]
+
+Vectors are synthetic, clustered and 384-dimensional like the padded TF-IDF embeddings.
+Recall@k is measured against exact float32 search. HNSW rows use hnswlib, the library
+behind Chroma's index, with the same M / ef_construction / ef_search knobs as ANN_HNSW_*.
+
+"memory MB" is measured for every row: the bytes held by ExactIndex's arrays for
+the exact backends, and the size of the built index written with hnswlib's
+save_index (vectors plus graph links, the same layout it keeps in memory) for HNSW.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import ExactIndex
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+DIMENSION = 384
+
+
+def make_corpus(n, rng, clusters=256):
+    """Gaussian clusters on the unit sphere, generated in blocks to bound peak memory"""
+    centers = rng.normal(size=(clusters, DIMENSION)).astype(np.float32)
+    vectors = np.empty((n, DIMENSION), dtype=np.float32)
+    for start in range(0, n, 100000):
+        end = min(start + 100000, n)
+        assignment = rng.integers(0, clusters, size=end - start)
+        block = centers[assignment] + 0.6 * rng.normal(size=(end - start, DIMENSION)).astype(np.float32)
+        vectors[start:end] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def ground_truth(vectors, queries, k):
+    truth = []
+    for query in queries:
+        scores = vectors @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        truth.append(set(top.tolist()))
+    return truth
+
+
+def measure(search, queries, truth, k):
+    """Run every query through `search` and return (recall@k, p50 ms, p95 ms)"""
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(expected & set(found))
+    return hits / (k * len(queries)), float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def hnsw_memory_bytes(index):
+    """Size of a built hnswlib index, measured by serializing it"""
+    fd, path = tempfile.mkstemp(suffix=".hnsw")
+    os.close(fd)
+    try:
+        index.save_index(path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def report(size, name, build_seconds, memory_bytes, recall, p50, p95):
+    print(f"{size:>9} {name:<32} {build_seconds:>8.1f} {memory_bytes / 1e6:>10.1f} {recall:>8.3f} {p50:>9.2f} {p95:>9.2f}")
+
+
+def bench_size(size, args, rng):
+    vectors = make_corpus(size, rng)
+    queries = vectors[rng.choice(size, args.queries, replace=False)] + 0.05 * rng.normal(size=(args.queries, DIMENSION)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = ground_truth(vectors, queries, args.k)
+
+    for quantization in ("none", "int8"):
+        start = time.perf_counter()
+        index = ExactIndex(DIMENSION, quantization)
+        index.add(list(range(size)), vectors)
+        build = time.perf_counter() - start
+        recall, p50, p95 = measure(lambda q, k: [doc_id for doc_id, _ in index.search(q, k)], queries, truth, args.k)
+        report(size, f"exact ({quantization})", build, index.memory_bytes(), recall, p50, p95)
+        del index
+
+    if hnswlib is None:
+        print(f"{size:>9} hnsw: skipped (hnswlib not installed)")
+        return
+
+    for m in args.m:
+        start = time.perf_counter()
+        index = hnswlib.Index(space="cosine", dim=DIMENSION)
+        index.init_index(max_elements=size, M=m, ef_construction=args.ef_construction)
+        index.add_items(vectors, np.arange(size))
+        build = time.perf_counter() - start
+        memory_bytes = hnsw_memory_bytes(index)
+        for ef_search in args.ef_search:
+            index.set_ef(max(ef_search, args.k))
+            recall, p50, p95 = measure(lambda q, k: index.knn_query(q, k=k)[0][0].tolist(), queries, truth, args.k)
+            report(size, f"hnsw M={m} efC={args.ef_construction} ef={ef_search}", build, memory_bytes, recall, p50, p95)
+        del index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--m", default="16,32")
+    parser.add_argument("--ef-construction", type=int, default=100)
+    parser.add_argument("--ef-search", default="10,50,100,200")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    args.m = [int(m) for m in args.m.split(",")]
+    args.ef_search = [int(ef) for ef in args.ef_search.split(",")]
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'chunks':>9} {'backend':<32} {'build s':>8} {'memory MB':>10} {'recall':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        bench_size(size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure the database work of one /chat turn as application_logs grows to millions of rows.
+
+Usage:
+    python benchmarks/chat_history_bench.py [--sizes 10000,100000,1000000,3000000]
+
+Each /chat turn reads the session history and appends one row. The LLM call is
+excluded so only the part that depends on table size is timed. "legacy" runs
+the old full-history query without the session index (NOT INDEXED), which is
+what every turn paid before turn counts and windowed reads.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="chat_history_bench_")
+
+import db_utils
+from db_utils import get_db_connection, get_chat_history, insert_application_logs
+from retention_utils import run_maintenance_step
+
+TURNS_PER_SESSION = 20
+LONG_SESSION = "long-session"
+LONG_SESSION_TURNS = 5000
+
+
+def grow_table(conn, start, end, answer):
+    """Append rows start..end-1, TURNS_PER_SESSION turns per session, and refresh turn counts"""
+    batch = 50000
+    for offset in range(start, end, batch):
+        rows = [(f"session-{i // TURNS_PER_SESSION}", f"question {i}", answer, "bench")
+                for i in range(offset, min(offset + batch, end))]
+        conn.executemany('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)', rows)
+        conn.commit()
+    # Bulk rows bypass insert_application_logs, so rebuild the counters they would have maintained
+    conn.execute('''INSERT OR REPLACE INTO chat_sessions (session_id, turn_count, archived_turns, first_at, last_at)
+                    SELECT session_id, COUNT(*), 0, MIN(created_at), MAX(created_at)
+                    FROM application_logs GROUP BY session_id''')
+    conn.commit()
+
+
+def legacy_history(session_id):
+    conn = get_db_connection()
+    rows = conn.execute('SELECT user_query, gpt_response FROM application_logs NOT INDEXED WHERE session_id = ? ORDER BY created_at',
+                        (session_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+def timed(fn, samples):
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000,3000000")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--legacy-samples", type=int, default=10)
+    parser.add_argument("--answer-chars", type=int, default=500)
+    parser.add_argument("--window", type=int, default=db_utils.CHAT_HISTORY_WINDOW)
+    args = parser.parse_args()
+
+    answer = "x" * args.answer_chars
+    conn = get_db_connection()
+    for i in range(LONG_SESSION_TURNS):
+        insert_application_logs(LONG_SESSION, f"long question {i}", answer, "bench")
+
+    print(f"database: {db_utils.DB_NAME}")
+    print(f"{'rows':>9} {'chat turn p50':>14} {'p95':>8} {'long session p50':>17} {'legacy p50':>11} {'db MB':>8}")
+    rows = LONG_SESSION_TURNS
+    for size in (int(s) for s in args.sizes.split(",")):
+        grow_table(conn, rows, size, answer)
+        rows = size
+        sessions = rows // TURNS_PER_SESSION
+
+        def chat_turn(session_id=None):
+            session_id = session_id or f"session-{random.randrange(sessions)}"
+            get_chat_history(session_id, args.window)
+            insert_application_logs(session_id, "bench question", answer, "bench")
+
+        p50, p95 = timed(chat_turn, args.samples)
+        long_p50, _ = timed(lambda: chat_turn(LONG_SESSION), args.samples)
+        legacy_p50, _ = timed(lambda: legacy_history(f"session-{random.randrange(sessions)}"), args.legacy_samples)
+        db_mb = os.path.getsize(db_utils.DB_NAME) / 1e6
+        print(f"{rows:>9} {p50:>12.2f}ms {p95:>6.2f}ms {long_p50:>15.2f}ms {legacy_p50:>9.1f}ms {db_mb:>8.0f}")
+
+    # Compact the long session and show reads still come from the hot table
+    stats = run_maintenance_step()
+    long_p50, _ = timed(lambda: get_chat_history(LONG_SESSION, args.window), args.samples)
+    print(f"after maintenance {stats}: long session history p50 {long_p50:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Exercise the LLM gateway against a local stub model that injects latency and 429 errors.
+
+Usage:
+    python benchmarks/llm_gateway_bench.py [--users 50] [--error-rate 0.2]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_gateway import LLMGateway, CircuitOpenError, GatewayBusyError, UpstreamRetriesExhaustedError
+
+
+class StubRateLimitError(Exception):
+    """Mimics google.api_core.exceptions.ResourceExhausted"""
+    code = 429
+
+
+class StubModel:
+    """Fake chat model: sleeps for `latency` seconds and fails with 429 at `error_rate`"""
+
+    def __init__(self, latency=0.2, error_rate=0.2, max_concurrency=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.calls = 0
+        self.active = 0
+        self.peak_active = 0
+        self.lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self.lock:
+            self.calls += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            overloaded = self.max_concurrency is not None and self.active > self.max_concurrency
+        try:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+            if overloaded or random.random() < self.error_rate:
+                raise StubRateLimitError("429 Resource has been exhausted (e.g. check quota).")
+            return f"answer to: {prompt}"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def run_load(gateway, model, users, distinct_prompts):
+    """Fire `users` concurrent requests drawn from `distinct_prompts` different questions"""
+    outcomes = {"ok": 0, "failed": 0, "circuit_open": 0, "busy": 0}
+    lock = threading.Lock()
+
+    def one_request(i):
+        prompt = f"question {i % distinct_prompts}"
+        try:
+            gateway.call(gateway.make_key(prompt), lambda: model.invoke(prompt))
+            outcome = "ok"
+        except CircuitOpenError:
+            outcome = "circuit_open"
+        except GatewayBusyError:
+            outcome = "busy"
+        except UpstreamRetriesExhaustedError:
+            outcome = "failed"
+        with lock:
+            outcomes[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(one_request, range(users)))
+    return outcomes, time.perf_counter() - start
+
+
+def scenario(title, gateway, model, users, distinct_prompts):
+    outcomes, elapsed = run_load(gateway, model, users, distinct_prompts)
+    print(f"\n== {title}")
+    print(f"   requests={users} distinct_prompts={distinct_prompts} elapsed={elapsed:.2f}s")
+    print(f"   outcomes={outcomes}")
+    print(f"   upstream calls={model.calls} peak upstream concurrency={model.peak_active}")
+    print(f"   gateway={gateway.get_stats()}")
+    return outcomes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--distinct-prompts", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    def new_gateway(**overrides):
+        config = dict(max_concurrency=4, rate_per_second=20, burst=8, max_retries=4,
+                      backoff_base=0.05, backoff_max=0.5, queue_timeout=30,
+                      failure_threshold=50, reset_timeout=1.0)
+        config.update(overrides)
+        return LLMGateway(**config)
+
+    # 1. Bursty traffic with transient 429s: concurrency is capped, retries absorb the errors
+    model = StubModel(args.latency, args.error_rate, max_concurrency=6)
+    outcomes = scenario("429s + burst, gateway on", new_gateway(), model, args.users, args.distinct_prompts)
+    assert model.peak_active <= 4, "semaphore did not cap upstream concurrency"
+    assert model.calls < args.users, "identical in-flight prompts were not coalesced"
+
+    # 2. Same traffic without a gateway, for comparison
+    baseline = StubModel(args.latency, args.error_rate, max_concurrency=6)
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        def direct(i):
+            try:
+                baseline.invoke(f"question {i % args.distinct_prompts}")
+                return True
+            except StubRateLimitError:
+                return False
+        failed = sum(1 for ok in pool.map(direct, range(args.users)) if not ok)
+    print("\n== 429s + burst, no gateway")
+    print(f"   failed={failed}/{args.users} upstream calls={baseline.calls} peak upstream concurrency={baseline.peak_active}")
+    print(f"   gateway failures={outcomes['failed']}/{args.users}")
+
+    # 3. Hard outage: the circuit opens and later requests fail fast instead of queueing
+    outage = StubModel(args.latency / 4, error_rate=1.0)
+    gateway = new_gateway(max_retries=1, failure_threshold=3, reset_timeout=5.0)
+    outcomes = scenario("upstream outage", gateway, outage, args.users, args.users)
+    assert outcomes["circuit_open"] > 0, "circuit breaker never opened"
+    assert gateway.breaker.state == gateway.breaker.OPEN
+
+    print("\nAll gateway checks passed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,21 @@
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, UnstructuredHTMLLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from typing import List
+from typing import List, Optional
 from langchain_core.documents import Document
 import os
+import time
+import pickle
+import threading
 import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 from sklearn.feature_extraction.text import TfidfVectorizer
+from ann_index import AnnConfig, AnnSearcher
+from text_store import hash_file, normalize_text, load_pages, save_pages
 
 # Text splitter configuration
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
@@ -13,10 +23,19 @@ text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=20
 # Global variables for lazy initialization
 vectorstore = None
 _embedding_function = None
+_ann_searcher = None
+
+# Serializes writes to the active collection with the collection swap done by reindexing
+index_write_lock = threading.RLock()
+
+DEFAULT_COLLECTION_NAME = "langchain"  # langchain_chroma's default, used before any reindex
+
+# Held by whichever process writes to the persistent Chroma directory (the server or `python reindex.py`)
+_writer_lock_file = None
 
 class SimpleTfidfEmbeddings:
     """Simple TF-IDF based embeddings that work offline"""
-    def __init__(self):
+    def __init__(self, path=None):
         self.vectorizer = TfidfVectorizer(
             max_features=384,
             stop_words='english',
@@ -25,12 +44,34 @@ class SimpleTfidfEmbeddings:
         )
         self.fitted = False
         self.dimension = 384
+        # Where the fitted vocabulary is saved, so a restart embeds queries in the same vector space
+        self.path = path
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.vectorizer = pickle.load(f)
+            self.fitted = True
+    
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.vectorizer, f)
+        os.replace(tmp_path, self.path)
+    
+    def fit(self, texts):
+        """Fit the vocabulary on a whole corpus (used when re-embedding everything)"""
+        if texts:
+            self.vectorizer.fit(texts)
+            self.fitted = True
+            self._save()
     
     def _ensure_fitted(self, texts):
         """Ensure the vectorizer is fitted"""
         if not self.fitted and texts:
             self.vectorizer.fit(texts)
             self.fitted = True
+            self._save()
     
     def embed_documents(self, texts):
         """Embed multiple documents"""
@@ -71,11 +112,73 @@ def get_embedding_function():
     
     print("Initializing embeddings...")
     
-    # Use simple TF-IDF embeddings for reliability
-    _embedding_function = SimpleTfidfEmbeddings()
-    print(" TF-IDF embeddings initialized successfully!")
+    # Use simple TF-IDF embeddings for reliability, with the vocabulary saved for the active collection
+    _embedding_function = SimpleTfidfEmbeddings(get_vectorizer_path(get_active_collection_name()))
+    print(f" TF-IDF embeddings initialized successfully! (fitted: {_embedding_function.fitted})")
     return _embedding_function
 
+def get_persist_dir():
+    data_dir = os.getenv("DATA_DIR", ".")
+    persist_dir = os.path.join(data_dir, "chroma_db")
+    os.makedirs(persist_dir, exist_ok=True)
+    return persist_dir
+
+def _active_collection_path():
+    return os.path.join(get_persist_dir(), "active_collection")
+
+def get_vectorizer_path(collection_name):
+    """Fitted TF-IDF vocabulary for a collection, stored next to the active-collection pointer"""
+    return os.path.join(get_persist_dir(), f"{collection_name}.tfidf.pkl")
+
+def acquire_writer_lock():
+    """Claim the persistent Chroma directory for this process. Returns False if another process holds it.
+
+    index_write_lock only covers threads of one process, so the server and the
+    reindex CLI must never write to the same store (or swap collections) at once.
+    The lock is released automatically when the process exits.
+    """
+    global _writer_lock_file
+    if _writer_lock_file is not None:
+        return True
+    lock_file = open(os.path.join(get_persist_dir(), "writer.lock"), "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return False
+    _writer_lock_file = lock_file
+    return True
+
+def get_active_collection_name():
+    """Name of the collection currently serving queries (changed by reindexing)"""
+    try:
+        with open(_active_collection_path()) as f:
+            return f.read().strip() or DEFAULT_COLLECTION_NAME
+    except FileNotFoundError:
+        return DEFAULT_COLLECTION_NAME
+
+def open_vector_store(collection_name, embedding_function):
+    """Open (or create) a Chroma collection in the persistent store"""
+    return Chroma(
+        collection_name=collection_name,
+        persist_directory=get_persist_dir(),
+        embedding_function=embedding_function,
+        # HNSW parameters only take effect when the collection is first created
+        collection_metadata=AnnConfig().collection_metadata()
+    )
+
+def warn_hnsw_mismatch(vectorstore, collection_name):
+    """Warn when ANN_HNSW_* differ from the parameters the collection was built with"""
+    mismatches = AnnConfig().mismatched_params(vectorstore._collection.metadata)
+    if mismatches:
+        details = ", ".join(f"{key}={actual} (configured {configured})" for key, configured, actual in mismatches)
+        print(f" Warning: collection {collection_name} uses {details}. HNSW parameters are fixed when a "
+              f"collection is created; call POST /admin/reindex to rebuild it with the configured values.")
+
 def get_vector_store():
     """Initialize and return the vectorstore"""
     global vectorstore
@@ -85,21 +188,50 @@ def get_vector_store():
     
     try:
         embedding_function = get_embedding_function()
-        data_dir = os.getenv("DATA_DIR", ".")
-        persist_dir = os.path.join(data_dir, "chroma_db")
-        os.makedirs(persist_dir, exist_ok=True)
-        vectorstore = Chroma(
-            persist_directory=persist_dir, 
-            embedding_function=embedding_function
-        )
-        print("ChromaDB vectorstore initialized successfully!")
+        collection_name = get_active_collection_name()
+        vectorstore = open_vector_store(collection_name, embedding_function)
+        print(f"ChromaDB vectorstore initialized successfully! (collection: {collection_name})")
+        warn_hnsw_mismatch(vectorstore, collection_name)
         return vectorstore
     except Exception as e:
         print(f" Error initializing vectorstore: {e}")
         raise
 
-def load_and_split_document(file_path: str) -> List[Document]:
-    """Load and split document based on file type"""
+def get_ann_searcher():
+    """Get the searcher that picks exact NumPy or HNSW search for the vectorstore"""
+    global _ann_searcher
+    
+    if _ann_searcher is not None:
+        return _ann_searcher
+    
+    config = AnnConfig()
+    _ann_searcher = AnnSearcher(get_vector_store(), get_embedding_function(), config)
+    print(f"ANN search initialized (backend={config.backend}, quantization={config.quantization}, "
+          f"M={config.m}, ef_construction={config.ef_construction}, ef_search={config.ef_search})")
+    return _ann_searcher
+
+def swap_vector_store(new_vectorstore, new_embedding_function, collection_name):
+    """Atomically make `new_vectorstore` the active collection. Returns the previous vectorstore.
+
+    Must be called with index_write_lock held. Queries already running keep
+    using the old collection; every query that starts afterwards uses the new one.
+    """
+    global vectorstore, _embedding_function
+    
+    old_vectorstore = get_vector_store()
+    pointer_path = _active_collection_path()
+    with open(pointer_path + ".tmp", "w") as f:
+        f.write(collection_name)
+    os.replace(pointer_path + ".tmp", pointer_path)
+    
+    vectorstore = new_vectorstore
+    _embedding_function = new_embedding_function
+    get_ann_searcher().swap(new_vectorstore, new_embedding_function)
+    print(f"Active collection switched to {collection_name}")
+    return old_vectorstore
+
+def load_document(file_path: str) -> List[Document]:
+    """Parse a document into normalized pages based on file type"""
     if file_path.endswith('.pdf'):
         loader = PyPDFLoader(file_path)
     elif file_path.endswith('.docx'):
@@ -109,52 +241,84 @@ def load_and_split_document(file_path: str) -> List[Document]:
     else:
         raise ValueError(f"Unsupported file type: {file_path}")
     
-    documents = loader.load()
+    pages = loader.load()
+    for page in pages:
+        page.page_content = normalize_text(page.page_content)
+    return pages
+
+def load_pages_cached(file_path: str, file_hash: str = None) -> List[Document]:
+    """Load parsed pages from the text store, parsing and storing them on a miss"""
+    file_hash = file_hash or hash_file(file_path)
+    pages = load_pages(file_hash)
+    if pages is None:
+        pages = load_document(file_path)
+        save_pages(file_hash, pages)
+    return pages
+
+def load_and_split_document(file_path: str, file_hash: str = None) -> List[Document]:
+    """Load and split document based on file type"""
+    documents = load_pages_cached(file_path, file_hash)
     splits = text_splitter.split_documents(documents)
     return splits
 
-def index_document_to_chroma(file_path: str, file_id: int) -> bool:
-    """Index a document to ChromaDB"""
+def annotate_splits(splits: List[Document], file_id: int, file_path: str, filename: str = None) -> List[str]:
+    """Add file metadata to each split and return deterministic chunk ids"""
+    filename = filename or os.path.basename(file_path)
+    for i, split in enumerate(splits):
+        split.metadata.update({
+            'file_id': file_id,
+            'filename': filename,
+            'chunk_index': i,
+            'total_chunks': len(splits),
+            'source': file_path
+        })
+    # Stable ids make re-adding a document an upsert instead of a duplicate
+    return [f"{file_id}:{i}" for i in range(len(splits))]
+
+def index_document_to_chroma(file_path: str, file_id: int, file_hash: str = None, filename: str = None) -> Optional[dict]:
+    """Index a document to ChromaDB. Returns indexing stats on success, None on failure."""
     try:
-        vectorstore = get_vector_store()
-        splits = load_and_split_document(file_path)
+        start = time.perf_counter()
+        splits = load_and_split_document(file_path, file_hash)
         
         # Add metadata to each split
-        filename = os.path.basename(file_path)
-        for i, split in enumerate(splits):
-            split.metadata.update({
-                'file_id': file_id,
-                'filename': filename,
-                'chunk_index': i,
-                'total_chunks': len(splits),
-                'source': file_path
-            })
+        ids = annotate_splits(splits, file_id, file_path, filename)
         
-        vectorstore.add_documents(splits)
-        print(f"Successfully indexed {filename} with {len(splits)} chunks")
-        return True
+        with index_write_lock:
+            vectorstore = get_vector_store()
+            ids = vectorstore.add_documents(splits, ids=ids)
+            get_ann_searcher().on_added(ids)
+        print(f"Successfully indexed {filename or os.path.basename(file_path)} with {len(splits)} chunks")
+        return {
+            'chunk_count': len(splits),
+            # Whitespace-delimited tokens; cheap and stable across embedding/LLM changes
+            'token_count': sum(len(split.page_content.split()) for split in splits),
+            'indexing_ms': int((time.perf_counter() - start) * 1000)
+        }
     except Exception as e:
         print(f" Error indexing document: {e}")
-        return False
+        return None
 
 def delete_doc_from_chroma(file_id: int) -> bool:
     """Delete a document from ChromaDB by file_id"""
     try:
-        vectorstore = get_vector_store()
-        
-        # Get documents with the specific file_id
-        docs = vectorstore.get(where={"file_id": file_id})
-        
-        if docs and docs.get('ids'):
-            print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+        with index_write_lock:
+            vectorstore = get_vector_store()
             
-            # Delete using the IDs
-            vectorstore.delete(ids=docs['ids'])
-            print(f" Successfully deleted all documents with file_id {file_id}")
-            return True
-        else:
-            print(f"No documents found for file_id {file_id}")
-            return False
+            # Get documents with the specific file_id
+            docs = vectorstore.get(where={"file_id": file_id})
+            
+            if docs and docs.get('ids'):
+                print(f"Found {len(docs['ids'])} document chunks for file_id {file_id}")
+                
+                # Delete using the IDs
+                vectorstore.delete(ids=docs['ids'])
+                get_ann_searcher().on_deleted(docs['ids'])
+                print(f" Successfully deleted all documents with file_id {file_id}")
+                return True
+            else:
+                print(f"No documents found for file_id {file_id}")
+                return False
             
     except Exception as e:
         print(f" Error deleting document with file_id {file_id} from Chroma: {str(e)}")
@@ -163,10 +327,8 @@ def delete_doc_from_chroma(file_id: int) -> bool:
 def search_vectorstore(collection, query: str, n_results: int = 4):
     """Search vectorstore for relevant documents"""
     try:
-        vectorstore = get_vector_store()
-        
-        # Use vectorstore similarity search
-        results = vectorstore.similarity_search(query, k=n_results)
+        # Use exact or HNSW similarity search depending on ANN settings
+        results = get_ann_searcher().similarity_search(query, k=n_results)
         
         # Convert to format expected by the rest of the code
         documents = [doc.page_content for doc in results]
@@ -1,9 +1,13 @@
 import sqlite3
 from datetime import datetime
 import os
+import json
+import base64
+import zlib
 
 DATA_DIR = os.getenv("DATA_DIR", ".")
 DB_NAME = os.path.join(DATA_DIR, "rag_app.db")
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))  # turns sent to the LLM; 0 = all
 
 def get_db_connection():
     conn = sqlite3.connect(DB_NAME)
@@ -11,6 +15,9 @@ def get_db_connection():
     return conn
 def create_application_logs():
     conn = get_db_connection()
+    # Lets the retention worker return freed pages in small steps. Only takes effect on a new,
+    # empty database; existing ones are converted with `python retention_utils.py --enable-incremental-vacuum`
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
     conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
                      session_id TEXT,
@@ -18,6 +25,37 @@ def create_application_logs():
                      gpt_response TEXT,
                      model TEXT,
                      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    # WAL lets /chat keep reading while the retention worker archives old turns
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_application_logs_session ON application_logs (session_id, id)')
+
+    # Per-session turn counts, so reading history only touches the last window of turns
+    is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_sessions'").fetchone() is None
+    conn.execute('''CREATE TABLE IF NOT EXISTS chat_sessions
+                    (session_id TEXT PRIMARY KEY,
+                     turn_count INTEGER NOT NULL DEFAULT 0,
+                     archived_turns INTEGER NOT NULL DEFAULT 0,
+                     first_at TIMESTAMP,
+                     last_at TIMESTAMP)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_sessions_last_at ON chat_sessions (last_at)')
+    if is_new:
+        conn.execute('''INSERT INTO chat_sessions (session_id, turn_count, first_at, last_at)
+                        SELECT session_id, COUNT(*), MIN(created_at), MAX(created_at)
+                        FROM application_logs GROUP BY session_id''')
+
+    # Compressed segments of old turns; with application_logs this is the full audit trail
+    conn.execute('''CREATE TABLE IF NOT EXISTS application_logs_archive
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     session_id TEXT NOT NULL,
+                     first_log_id INTEGER,
+                     last_log_id INTEGER,
+                     turn_count INTEGER,
+                     first_at TIMESTAMP,
+                     last_at TIMESTAMP,
+                     payload BLOB NOT NULL)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_application_logs_archive_session
+                    ON application_logs_archive (session_id, last_log_id)''')
+    conn.commit()
     conn.close()
 
 def create_document_store():
@@ -38,33 +76,98 @@ def create_document_store():
         conn.execute('ALTER TABLE document_store ADD COLUMN content_type TEXT DEFAULT "application/octet-stream"')
     except sqlite3.OperationalError:
         pass  # Column already exists
-    
+
+    # Per-document stats, filled in once the document has been indexed
+    for column in ('chunk_count', 'token_count', 'indexing_ms'):
+        try:
+            conn.execute(f'ALTER TABLE document_store ADD COLUMN {column} INTEGER DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+
+    # SHA-256 of the uploaded file; keys the parsed-text store used for re-chunking
+    try:
+        conn.execute('ALTER TABLE document_store ADD COLUMN file_hash TEXT')
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+
+    # Index for the newest-first, cursor-paginated listing
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_document_store_upload_timestamp
+                    ON document_store (upload_timestamp DESC, id DESC)''')
+
+    # Corpus version: bumped by triggers on every change so listings can be cached and ETagged
+    conn.execute('''CREATE TABLE IF NOT EXISTS corpus_version
+                    (id INTEGER PRIMARY KEY CHECK (id = 1),
+                     version INTEGER NOT NULL)''')
+    conn.execute('INSERT OR IGNORE INTO corpus_version (id, version) VALUES (1, 0)')
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS document_store_version_{event.lower()}
+                         AFTER {event} ON document_store
+                         BEGIN
+                             UPDATE corpus_version SET version = version + 1 WHERE id = 1;
+                         END''')
+
     conn.commit()
     conn.close()
 def insert_application_logs(session_id, user_query, gpt_response, model):
     conn = get_db_connection()
     conn.execute('INSERT INTO application_logs (session_id, user_query, gpt_response, model) VALUES (?, ?, ?, ?)',
                  (session_id, user_query, gpt_response, model))
+    conn.execute('''INSERT INTO chat_sessions (session_id, turn_count, first_at, last_at)
+                    VALUES (?, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    ON CONFLICT(session_id) DO UPDATE SET turn_count = turn_count + 1, last_at = CURRENT_TIMESTAMP''',
+                 (session_id,))
     conn.commit()
     conn.close()
 
-def get_chat_history(session_id):
+def encode_archive_payload(rows):
+    """Compress archived turns: a list of (id, user_query, gpt_response, model, created_at)"""
+    return zlib.compress(json.dumps([list(row) for row in rows]).encode('utf-8'), 6)
+
+def decode_archive_payload(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+def _get_archived_turns(conn, session_id, count):
+    """Most recent `count` archived (user_query, gpt_response) pairs for a session, oldest first"""
+    turns = []
+    segments = conn.execute('''SELECT payload FROM application_logs_archive WHERE session_id = ?
+                               ORDER BY last_log_id DESC''', (session_id,))
+    for segment in segments:
+        rows = decode_archive_payload(segment['payload'])
+        turns = [(row[1], row[2]) for row in rows] + turns
+        if len(turns) >= count:
+            break
+    return turns[-count:]
+
+def get_chat_history(session_id, window=CHAT_HISTORY_WINDOW):
+    """Last `window` turns of a session as LangChain messages (window <= 0 returns every turn)"""
     conn = get_db_connection()
+    session = conn.execute('SELECT turn_count, archived_turns FROM chat_sessions WHERE session_id = ?',
+                           (session_id,)).fetchone()
+    if session is None or session['turn_count'] == 0:
+        conn.close()
+        return []
+
+    wanted = session['turn_count'] if window <= 0 else min(window, session['turn_count'])
     cursor = conn.cursor()
-    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
-    messages = []
-    for row in cursor.fetchall():
-        # Format for LangChain: use HumanMessage and AIMessage format
-        from langchain_core.messages import HumanMessage, AIMessage
-        messages.append(HumanMessage(content=row['user_query']))
-        messages.append(AIMessage(content=row['gpt_response']))
+    cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY id DESC LIMIT ?',
+                   (session_id, wanted))
+    turns = [(row['user_query'], row['gpt_response']) for row in reversed(cursor.fetchall())]
+    if len(turns) < wanted and session['archived_turns'] > 0:
+        turns = _get_archived_turns(conn, session_id, wanted - len(turns)) + turns
     conn.close()
+
+    # Format for LangChain: use HumanMessage and AIMessage format
+    from langchain_core.messages import HumanMessage, AIMessage
+    messages = []
+    for user_query, gpt_response in turns:
+        messages.append(HumanMessage(content=user_query))
+        messages.append(AIMessage(content=gpt_response))
     return messages
-def insert_document_record(filename, file_size=0, content_type="application/octet-stream"):
+def insert_document_record(filename, file_size=0, content_type="application/octet-stream", file_hash=None):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('INSERT INTO document_store (filename, file_size, content_type) VALUES (?, ?, ?)', 
-                   (filename, file_size, content_type))
+    cursor.execute('INSERT INTO document_store (filename, file_size, content_type, file_hash) VALUES (?, ?, ?, ?)', 
+                   (filename, file_size, content_type, file_hash))
     file_id = cursor.lastrowid
     conn.commit()
     conn.close()
@@ -77,10 +180,100 @@ def delete_document_record(file_id):
     conn.close()
     return True
 
+def update_document_stats(file_id, chunk_count, token_count, indexing_ms):
+    conn = get_db_connection()
+    conn.execute('UPDATE document_store SET chunk_count = ?, token_count = ?, indexing_ms = ? WHERE id = ?',
+                 (chunk_count, token_count, indexing_ms, file_id))
+    conn.commit()
+    conn.close()
+
+def update_documents_stats(rows):
+    """Write (file_id, chunk_count, token_count, indexing_ms) rows in one transaction"""
+    conn = get_db_connection()
+    conn.executemany('UPDATE document_store SET chunk_count = ?, token_count = ?, indexing_ms = ? WHERE id = ?',
+                     [(chunk_count, token_count, indexing_ms, file_id) for file_id, chunk_count, token_count, indexing_ms in rows])
+    conn.commit()
+    conn.close()
+
+def set_document_hash(file_id, file_hash):
+    conn = get_db_connection()
+    conn.execute('UPDATE document_store SET file_hash = ? WHERE id = ?', (file_hash, file_id))
+    conn.commit()
+    conn.close()
+
+def get_document_hash(file_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT file_hash FROM document_store WHERE id = ?', (file_id,)).fetchone()
+    conn.close()
+    return row['file_hash'] if row else None
+
+def is_file_hash_referenced(file_hash):
+    """True if any document still points at this parsed-text entry"""
+    conn = get_db_connection()
+    row = conn.execute('SELECT 1 FROM document_store WHERE file_hash = ? LIMIT 1', (file_hash,)).fetchone()
+    conn.close()
+    return row is not None
+
+def get_documents_for_reindex():
+    conn = get_db_connection()
+    rows = conn.execute('SELECT id, filename, file_hash FROM document_store ORDER BY id').fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+def get_corpus_version():
+    conn = get_db_connection()
+    row = conn.execute('SELECT version FROM corpus_version WHERE id = 1').fetchone()
+    conn.close()
+    return row['version'] if row else 0
+
+def encode_document_cursor(upload_timestamp, file_id):
+    raw = json.dumps([str(upload_timestamp), file_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_document_cursor(cursor):
+    try:
+        upload_timestamp, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(upload_timestamp), int(file_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_documents_page(limit=100, cursor=None):
+    """Return (documents, next_cursor) newest first, using keyset pagination on (upload_timestamp, id)"""
+    where = ''
+    params = []
+    if cursor:
+        upload_timestamp, file_id = decode_document_cursor(cursor)
+        # Row-value comparison lets SQLite seek straight into the index
+        where = 'WHERE (upload_timestamp, id) < (?, ?)'
+        params = [upload_timestamp, file_id]
+    conn = get_db_connection()
+    rows = conn.execute(f'''SELECT id, filename, upload_timestamp, file_size, content_type,
+                                   chunk_count, token_count, indexing_ms
+                            FROM document_store {where}
+                            ORDER BY upload_timestamp DESC, id DESC
+                            LIMIT ?''', params + [limit + 1]).fetchall()
+    conn.close()
+    documents = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = documents[-1]
+        next_cursor = encode_document_cursor(last['upload_timestamp'], last['id'])
+    return documents, next_cursor
+
+def get_corpus_stats():
+    conn = get_db_connection()
+    row = conn.execute('''SELECT COUNT(*) AS document_count,
+                                 COALESCE(SUM(file_size), 0) AS total_file_size,
+                                 COALESCE(SUM(chunk_count), 0) AS chunk_count,
+                                 COALESCE(SUM(token_count), 0) AS token_count
+                          FROM document_store''').fetchone()
+    conn.close()
+    return dict(row)
+
 def get_all_documents():
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, filename, upload_timestamp, file_size, content_type FROM document_store ORDER BY upload_timestamp DESC')
+    cursor.execute('SELECT id, filename, upload_timestamp, file_size, content_type, chunk_count, token_count, indexing_ms FROM document_store ORDER BY upload_timestamp DESC, id DESC')
     documents = cursor.fetchall()
     conn.close()
     return [dict(doc) for doc in documents]
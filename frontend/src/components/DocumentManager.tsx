@@ -27,6 +27,7 @@ export default function DocumentManager({ onDocumentChange, detailed = false }:
   const [dragActive, setDragActive] = useState(false)
   const [documents, setDocuments] = useState<DocumentInfo[]>([])
   const [isLoadingDocs, setIsLoadingDocs] = useState(false)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [searchQuery, setSearchQuery] = useState('')
   const [toasts, setToasts] = useState<Array<{ id: number; message: string; type: 'success' | 'error' | 'info' }>>([])
   const fileInputRef = useRef<HTMLInputElement>(null)
@@ -51,11 +52,13 @@ export default function DocumentManager({ onDocumentChange, detailed = false }:
     setToasts(prev => prev.filter(t => t.id !== id))
   }
 
+  // Loads the newest page; older documents are fetched page by page with loadMoreDocuments
   const loadDocuments = async () => {
     setIsLoadingDocs(true)
     try {
-      const docs = await chatAPI.listDocuments()
-      setDocuments(docs)
+      const page = await chatAPI.listDocumentsPage()
+      setDocuments(page.documents)
+      setNextCursor(page.nextCursor)
     } catch (error) {
       console.error('Failed to load documents:', error)
     } finally {
@@ -63,6 +66,20 @@ export default function DocumentManager({ onDocumentChange, detailed = false }:
     }
   }
 
+  const loadMoreDocuments = async () => {
+    if (!nextCursor) return
+    setIsLoadingDocs(true)
+    try {
+      const page = await chatAPI.listDocumentsPage(nextCursor)
+      setDocuments(prev => [...prev, ...page.documents])
+      setNextCursor(page.nextCursor)
+    } catch (error) {
+      console.error('Failed to load more documents:', error)
+    } finally {
+      setIsLoadingDocs(false)
+    }
+  }
+
   const handleFileUpload = async (files: FileList | null) => {
     if (!files || files.length === 0) return
 
@@ -235,7 +252,7 @@ export default function DocumentManager({ onDocumentChange, detailed = false }:
         <div className="space-y-3">
           <div className="flex items-center justify-between">
             <h3 className="text-sm font-medium text-gray-700">
-              Uploaded Documents ({documents.length})
+              Uploaded Documents ({documents.length}{nextCursor ? '+' : ''})
             </h3>
             <Button
               onClick={loadDocuments}
@@ -285,6 +302,15 @@ export default function DocumentManager({ onDocumentChange, detailed = false }:
                 </Card>
               ))
             )}
+            {nextCursor && (
+              <Button
+                onClick={loadMoreDocuments}
+                disabled={isLoadingDocs}
+                className="w-full text-xs"
+              >
+                {isLoadingDocs ? <Loader2 className="h-3 w-3 animate-spin mx-auto" /> : 'Load more'}
+              </Button>
+            )}
           </div>
         </div>
       )}
@@ -27,6 +27,22 @@ export interface DocumentInfo {
   upload_timestamp: string;
   file_size: number;
   content_type: string;
+  chunk_count?: number;
+  token_count?: number;
+  indexing_ms?: number;
+}
+
+export interface DocumentPage {
+  documents: DocumentInfo[];
+  nextCursor: string | null;
+}
+
+export interface CorpusStats {
+  corpus_version: number;
+  document_count: number;
+  total_file_size: number;
+  chunk_count: number;
+  token_count: number;
 }
 
 export interface UploadResponse {
@@ -72,6 +88,19 @@ export const chatAPI = {
     return response.data;
   },
 
+  listDocumentsPage: async (cursor?: string, limit = 100): Promise<DocumentPage> => {
+    const response = await api.get<DocumentInfo[]>('/list-docs', { params: { cursor, limit } });
+    return {
+      documents: response.data,
+      nextCursor: response.headers['x-next-cursor'] || null,
+    };
+  },
+
+  getCorpusStats: async (): Promise<CorpusStats> => {
+    const response = await api.get<CorpusStats>('/corpus-stats');
+    return response.data;
+  },
+
   deleteDocument: async (fileId: number): Promise<{ message: string }> => {
     const response = await api.post<{ message: string }>('/delete-doc', { file_id: fileId });
     return response.data;
@@ -4,16 +4,21 @@ from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever, create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
-from typing import List, Any
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import List, Any, Optional
 import os
-from chroma_utils import get_vector_store
+from chroma_utils import get_vector_store, get_ann_searcher
+from llm_gateway import get_llm_gateway
 
 # Custom retriever class that inherits from BaseRetriever
 class ChromaRetriever(BaseRetriever):
     """Custom retriever that works with LangChain's pipeline operators"""
     
     vectorstore: Any = None
+    index: Any = None  # AnnSearcher; falls back to the vectorstore's own search when unset
     k: int = 6
     
     class Config:
@@ -24,17 +29,50 @@ class ChromaRetriever(BaseRetriever):
     ) -> List[Any]:
         """Get relevant documents for a query with improved relevance filtering"""
         try:
-            # Use regular similarity search (more compatible)
-            results = self.vectorstore.similarity_search(query, k=self.k)
+            # Exact or HNSW search depending on collection size and ANN settings
+            searcher = self.index if self.index is not None else self.vectorstore
+            results = searcher.similarity_search(query, k=self.k)
             return results
         except Exception as e:
             print(f"Retriever error: {e}")
             return []
 
+# Chat model wrapper that routes every call through the shared LLM gateway
+class GatewayChatModel(BaseChatModel):
+    """Chat model that applies concurrency/rate limits, coalescing, retries and circuit breaking"""
+
+    llm: Any = None
+    gateway: Any = None
+    model: str = ""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: CallbackManagerForLLMRun = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Generate a response, sharing the upstream call with identical in-flight prompts"""
+        key = self.gateway.make_key(
+            self.model,
+            [(message.type, message.content) for message in messages],
+            stop,
+            sorted(kwargs.items()),
+        )
+        message = self.gateway.call(key, lambda: self.llm.invoke(messages, stop=stop, **kwargs))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
 # Initialize vector store and retriever
 try:
     vectorstore = get_vector_store()
-    retriever = ChromaRetriever(vectorstore=vectorstore, k=8)  # Retrieve more documents for better context
+    retriever = ChromaRetriever(vectorstore=vectorstore, index=get_ann_searcher(), k=8)  # Retrieve more documents for better context
     print(" Retriever initialized successfully!")
 except Exception as e:
     print(f" Warning: Could not initialize retriever: {e}")
@@ -152,8 +190,10 @@ def get_rag_chain(model="gemini-2.0-flash-exp"):
                 google_api_key=api_key,
                 temperature=0.3,  # Slightly higher for more creative responses
                 max_tokens=3072,   # Increased for more detailed responses
-                convert_system_message_to_human=True  # Fix for SystemMessage compatibility
+                convert_system_message_to_human=True,  # Fix for SystemMessage compatibility
+                max_retries=1  # Retries and backoff are handled by the LLM gateway
             )
+            llm = GatewayChatModel(llm=llm, gateway=get_llm_gateway(), model=model)
             print(" Gemini LLM initialized successfully!")
         else:
             raise ValueError("No valid API key found")
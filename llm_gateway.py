@@ -0,0 +1,335 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Status codes / exception names that mean "upstream is overloaded, try again later"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_EXCEPTION_NAMES = {
+    "ResourceExhausted",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+    "TooManyRequests",
+    "TimeoutError",
+}
+
+# Global variables for lazy initialization
+_gateway = None
+
+
+class LLMGatewayError(Exception):
+    """Base class for errors raised by the gateway itself (not by the model)"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        # Seconds the client should wait before retrying, when the gateway can tell
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMGatewayError):
+    """Raised when the circuit breaker is open and calls are rejected immediately"""
+
+
+class GatewayBusyError(LLMGatewayError):
+    """Raised when a call could not get a concurrency slot or rate token in time"""
+
+
+class UpstreamRetriesExhaustedError(LLMGatewayError):
+    """Raised when a retryable upstream error (429/5xx) persists after every retry; the original is __cause__"""
+
+
+def is_retryable_error(exc):
+    """Return True if the exception looks like a transient upstream failure"""
+    for attr in ("code", "status_code", "status"):
+        value = getattr(exc, attr, None)
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = None
+        # grpc status codes are enums whose value is a (number, name) tuple
+        value = getattr(value, "value", value)
+        if isinstance(value, tuple) and value:
+            value = value[0]
+        if isinstance(value, int) and value in RETRYABLE_STATUS_CODES:
+            return True
+    if type(exc).__name__ in RETRYABLE_EXCEPTION_NAMES:
+        return True
+    message = str(exc)
+    return "429" in message or "Resource has been exhausted" in message
+
+
+class TokenBucket:
+    """Thread-safe token bucket that refills at `rate` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, timeout=None):
+        """Take one token, waiting up to `timeout` seconds. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Closed -> open after `failure_threshold` consecutive failures, half-open after `reset_timeout`"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        """Cheap check used to reject calls before they queue for a slot"""
+        with self.lock:
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial call through (0 when not open)"""
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call should not be attempted.
+
+        Returns True when the caller holds the single half-open trial slot.
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError("LLM circuit breaker is open; upstream is failing", retry_after=remaining)
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                # Only one trial request is let through while half-open
+                if self.trial_in_flight:
+                    raise CircuitOpenError("LLM circuit breaker is half-open; trial request in flight")
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = self.CLOSED
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Give back the half-open trial slot when a call ended without a verdict"""
+        with self.lock:
+            self.trial_in_flight = False
+
+
+class _Flight:
+    """A single in-flight call that concurrent identical callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share the same key"""
+
+    def __init__(self):
+        self.flights = {}
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Run `fn` once per key; concurrent callers with the same key share its result"""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+
+class LLMGateway:
+    """Concurrency cap, rate limit, request coalescing, retries and circuit breaking for LLM calls"""
+
+    def __init__(
+        self,
+        max_concurrency=4,
+        rate_per_second=2.0,
+        burst=4,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        queue_timeout=30.0,
+        failure_threshold=5,
+        reset_timeout=30.0,
+    ):
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.single_flight = SingleFlight()
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self.stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "upstream_calls": 0, "retries": 0, "rejected": 0, "exhausted": 0}
+
+    def _count(self, name, n=1):
+        with self.stats_lock:
+            self.stats[name] += n
+
+    def get_stats(self):
+        """Snapshot of gateway counters and circuit breaker state"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["coalesced"] = self.single_flight.coalesced
+        stats["circuit_state"] = self.breaker.state
+        return stats
+
+    def backoff_delay(self, attempt):
+        """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def make_key(*parts):
+        """Build a stable single-flight key from the parts that define a prompt"""
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def call(self, key, fn):
+        """Invoke `fn` through the gateway. Identical concurrent `key`s share one upstream call."""
+        self._count("calls")
+        if key is None:
+            return self._call_with_retries(fn)
+        return self.single_flight.do(key, lambda: self._call_with_retries(fn))
+
+    def _call_with_retries(self, fn):
+        attempt = 0
+        while True:
+            if self.breaker.is_open():
+                self._count("rejected")
+                raise CircuitOpenError("LLM circuit breaker is open; upstream is failing",
+                                       retry_after=self.breaker.retry_after())
+            trial = False
+            try:
+                with self._slot():
+                    # Re-check after queueing: the circuit may have opened while we waited
+                    trial = self.breaker.before_call()
+                    self._count("upstream_calls")
+                    result = fn()
+            except LLMGatewayError:
+                self._count("rejected")
+                raise
+            except Exception as e:
+                if not is_retryable_error(e):
+                    if trial:
+                        self.breaker.release_trial()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self._count("exhausted")
+                    raise UpstreamRetriesExhaustedError(
+                        f"LLM upstream still failing after {self.max_retries} retries ({type(e).__name__})",
+                        retry_after=self.backoff_max,
+                    ) from e
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                self._count("retries")
+                print(f"LLM call failed ({type(e).__name__}), retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    @contextmanager
+    def _slot(self):
+        """Hold a concurrency slot and a rate-limit token for one upstream call"""
+        if not self.semaphore.acquire(timeout=self.queue_timeout):
+            raise GatewayBusyError("Timed out waiting for a free LLM concurrency slot")
+        try:
+            if not self.bucket.acquire(timeout=self.queue_timeout):
+                raise GatewayBusyError("Timed out waiting for LLM rate limit")
+            yield
+        finally:
+            self.semaphore.release()
+
+
+def get_llm_gateway():
+    """Get the process-wide LLM gateway, configured from environment variables"""
+    global _gateway
+
+    if _gateway is not None:
+        return _gateway
+
+    _gateway = LLMGateway(
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+        rate_per_second=float(os.getenv("LLM_RATE_PER_SECOND", "2")),
+        burst=int(os.getenv("LLM_BURST", "4")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+        backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "8")),
+        queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "30")),
+        failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", "5")),
+        reset_timeout=float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30")),
+    )
+    return _gateway
@@ -1,14 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic_models import QueryInput, QueryResponse, DocumentInfo, DeleteFileRequest
+from pydantic_models import (QueryInput, QueryResponse, DocumentInfo, CorpusStats, DeleteFileRequest, UploadInitRequest,
+                             UploadStatus, UploadCompleteRequest, ReindexRequest)
 from langchain_utils import get_rag_chain
-from db_utils import insert_application_logs, get_chat_history, get_all_documents, insert_document_record, delete_document_record
-from chroma_utils import index_document_to_chroma, delete_doc_from_chroma
+from db_utils import (insert_application_logs, get_chat_history, insert_document_record, delete_document_record,
+                      update_document_stats, get_all_documents, get_documents_page, decode_document_cursor,
+                      get_corpus_version, get_corpus_stats, get_document_hash, is_file_hash_referenced)
+from chroma_utils import index_document_to_chroma, delete_doc_from_chroma, index_write_lock, acquire_writer_lock
+from text_store import delete_pages
+from llm_gateway import LLMGatewayError, get_llm_gateway
+from reindex import start_reindex_job, get_reindex_status
+from retention_utils import mark_activity, start_retention_worker
+from upload_utils import (UploadValidationError, validate_filename, stream_to_disk, new_temp_path, stored_upload_path,
+                          CHUNK_SIZE, create_upload_session, get_upload_status, append_upload_chunk, complete_upload, abort_upload,
+                          cleanup_stale_uploads)
 import os
 import uuid
 import logging
-import shutil
+import hmac
+import math
+import threading
 import uvicorn
+from typing import Optional
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -25,7 +38,10 @@ os.makedirs(DATA_DIR, exist_ok=True)
 LOG_PATH = os.path.join(DATA_DIR, 'app.log')
 UPLOADS_DIR = os.path.join(DATA_DIR, 'uploads')
 os.makedirs(UPLOADS_DIR, exist_ok=True)
+INCOMPLETE_UPLOADS_DIR = os.path.join(UPLOADS_DIR, '.incomplete')
+os.makedirs(INCOMPLETE_UPLOADS_DIR, exist_ok=True)
 logging.basicConfig(filename=LOG_PATH, level=logging.INFO)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 
 app = FastAPI(
@@ -47,8 +63,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+@app.middleware("http")
+async def track_activity(request: Request, call_next):
+    # Chat log archiving and VACUUM only run once the API has gone quiet (health checks don't count)
+    if request.url.path not in ("/", "/health"):
+        mark_activity()
+    return await call_next(request)
+
+@app.on_event("startup")
+def start_background_workers():
+    # The reindex CLI must not swap collections under a running server, and vice versa
+    if not acquire_writer_lock():
+        raise RuntimeError("The vector store is locked by `python reindex.py`; start the server once it finishes")
+    # Temp files left by uploads that were cut off by a crash or restart
+    cleanup_stale_uploads(INCOMPLETE_UPLOADS_DIR)
+    start_retention_worker()
+
 @app.get("/")
 @app.head("/")  # Support HEAD requests for health checks
 def read_root():
@@ -65,6 +98,7 @@ def health_check():
             "vector_store": "connected",
             "embeddings": "sentence-transformers (all-MiniLM-L12-v2)",
             "embedding_dimensions": 384,
+            "llm_gateway": get_llm_gateway().get_stats(),
             "timestamp": str(datetime.now())
         }
     except Exception as e:
@@ -100,92 +134,240 @@ def chat(query_input: QueryInput):
         logging.info(f"Session ID: {session_id}, AI Response: {answer}")
         return QueryResponse(answer=answer, session_id=session_id, model=query_input.model)
         
+    except LLMGatewayError as e:
+        # Gateway rejected the call (circuit open, queue full or upstream still rate limited after retries)
+        logging.warning(f"LLM gateway rejected query: {str(e)}")
+        retry_after = max(1, math.ceil(e.retry_after or 1))
+        raise HTTPException(status_code=503,
+                            detail=f"The AI service is temporarily overloaded, please try again shortly. ({str(e)})",
+                            headers={"Retry-After": str(retry_after)})
     except Exception as e:
         error_msg = f"Error processing query: {str(e)}"
         logging.error(error_msg)
         print(f"Chat endpoint error: {error_msg}")  # Also print to console for debugging
         raise HTTPException(status_code=500, detail=f"An error occurred while processing your request: {str(e)}")
 
+def corpus_etag(version):
+    return f'W/"corpus-{version}"'
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+# Listing pages cached per corpus version; any document change bumps the version and empties the cache
+_document_page_cache = {}
+_document_page_cache_version = None
+_document_page_cache_lock = threading.Lock()
+DOCUMENT_PAGE_CACHE_SIZE = 256
+DEFAULT_DOCUMENT_PAGE_SIZE = 100
+
+def get_cached_documents_page(version, limit, cursor):
+    """(documents, next_cursor) for one listing page; limit=None lists every document"""
+    global _document_page_cache_version
+    key = (version, limit, cursor)
+    with _document_page_cache_lock:
+        page = _document_page_cache.get(key)
+    if page is not None:
+        return page
+
+    page = (get_all_documents(), None) if limit is None else get_documents_page(limit, cursor)
+    with _document_page_cache_lock:
+        # A request that read an older version must not store its page after the cache moved on
+        if _document_page_cache_version is None or version > _document_page_cache_version:
+            _document_page_cache.clear()
+            _document_page_cache_version = version
+        if version == _document_page_cache_version:
+            if len(_document_page_cache) >= DOCUMENT_PAGE_CACHE_SIZE:
+                _document_page_cache.clear()
+            _document_page_cache[key] = page
+    return page
+
 @app.get("/list-docs", response_model=list[DocumentInfo])
-def list_documents():
-    return get_all_documents()
+def list_documents(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+    """List documents newest first.
+
+    Without `limit` or `cursor` every document is returned, as before pagination existed.
+    Pass `limit` to get one page, then send the X-Next-Cursor header back as `cursor`
+    to get the next one.
+    """
+    # Validate the cursor first so a malformed one is a 400 even when the ETag still matches
+    if cursor:
+        try:
+            decode_document_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    version = get_corpus_version()
+    etag = corpus_etag(version)
+    # no-cache: browsers keep the response but revalidate it with If-None-Match every time
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if cursor and limit is None:
+        limit = DEFAULT_DOCUMENT_PAGE_SIZE
+    try:
+        documents, next_cursor = get_cached_documents_page(version, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response.headers.update(headers)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return documents
+
+@app.get("/corpus-stats", response_model=CorpusStats)
+def corpus_stats(response: Response, if_none_match: Optional[str] = Header(None)):
+    """Totals across all documents, computed from the per-document stats stored at index time"""
+    version = get_corpus_version()
+    etag = corpus_etag(version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return CorpusStats(corpus_version=version, **get_corpus_stats())
+
+def release_parsed_text(file_hash):
+    """Drop a document's parsed text once no remaining document shares its hash; call with index_write_lock held"""
+    if file_hash and not is_file_hash_referenced(file_hash):
+        delete_pages(file_hash)
+
+def register_and_index_document(part_path, filename, file_size, content_type, file_hash=None):
+    """Record an uploaded file in the database, move it to its own path and index it, cleaning up on failure"""
+    # Insert document record and get file_id
+    try:
+        file_id = insert_document_record(filename, file_size, content_type, file_hash)
+    except Exception:
+        os.remove(part_path)
+        raise
+    
+    # The file_id prefix means a same-name upload can never overwrite or delete this file
+    file_path = stored_upload_path(UPLOADS_DIR, file_id, filename)
+    os.replace(part_path, file_path)
+    
+    # Index document to ChromaDB
+    stats = index_document_to_chroma(file_path, file_id, file_hash, filename)
+    
+    if stats:
+        update_document_stats(file_id, stats["chunk_count"], stats["token_count"], stats["indexing_ms"])
+        logging.info(f"Successfully uploaded and indexed: {filename} with file_id: {file_id} ({stats})")
+        return {
+            "message": f"Successfully uploaded and indexed document: {filename}",
+            "file_id": file_id,
+            "filename": filename,
+            "file_size": file_size,
+            **stats
+        }
+    else:
+        # If indexing fails, delete the database record (and any chunks a concurrent reindex added for it)
+        with index_write_lock:
+            delete_doc_from_chroma(file_id)
+            delete_document_record(file_id)
+            release_parsed_text(file_hash)
+        os.remove(file_path)  # Also remove the uploaded file
+        raise HTTPException(status_code=500, detail="Failed to index document to ChromaDB")
 
 @app.post("/upload-doc")
 def upload_document(file: UploadFile = File(...)):
     """Upload and index a document to the RAG system"""
     try:
-        # Validate file
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No file provided")
-        
-        # Validate file type
-        allowed_extensions = ['.pdf', '.docx', '.html']
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        
-        if file_extension not in allowed_extensions:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File type {file_extension} not supported. Allowed: {allowed_extensions}"
-            )
-        
-        # Check file size (limit to 10MB)
-        file.file.seek(0, 2)  # Seek to end
-        file_size = file.file.tell()
-        file.file.seek(0)  # Reset to beginning
+        # Validate file name and type
+        filename = validate_filename(file.filename)
         
-        max_size = 10 * 1024 * 1024  # 10MB
-        if file_size > max_size:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"File too large. Maximum size: {max_size // (1024*1024)}MB"
-            )
+        # Stream to disk in chunks; magic bytes and the size limit are checked as data arrives
+        part_path, file_size, sha256 = stream_to_disk(file.file, INCOMPLETE_UPLOADS_DIR, filename)
+        logging.info(f"Received {filename} ({file_size} bytes, sha256 {sha256})")
         
-        # Create uploads directory if it doesn't exist
-        upload_dir = UPLOADS_DIR
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # Save the uploaded file
-        file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Get actual file size and content type
-        actual_file_size = os.path.getsize(file_path)
         content_type = file.content_type or "application/octet-stream"
-        
-        # Insert document record and get file_id
-        file_id = insert_document_record(file.filename, actual_file_size, content_type)
-        
-        # Index document to ChromaDB
-        success = index_document_to_chroma(file_path, file_id)
-        
-        if success:
-            logging.info(f"Successfully uploaded and indexed: {file.filename} with file_id: {file_id}")
-            return {
-                "message": f"Successfully uploaded and indexed document: {file.filename}",
-                "file_id": file_id,
-                "filename": file.filename,
-                "file_size": actual_file_size
-            }
-        else:
-            # If indexing fails, delete the database record
-            delete_document_record(file_id)
-            os.remove(file_path)  # Also remove the uploaded file
-            raise HTTPException(status_code=500, detail="Failed to index document to ChromaDB")
+        return register_and_index_document(part_path, filename, file_size, content_type, sha256)
             
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except HTTPException:
         raise  # Re-raise HTTP exceptions
     except Exception as e:
         logging.error(f"Error uploading document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
 
+# Resumable uploads: POST /uploads, then PUT chunks in order, then POST /uploads/{id}/complete.
+# Each request only holds a worker for one chunk, and a dropped connection resumes from `received`.
+
+@app.post("/uploads", response_model=UploadStatus)
+def start_upload(request: UploadInitRequest):
+    """Start a resumable upload"""
+    try:
+        state = create_upload_session(INCOMPLETE_UPLOADS_DIR, request.filename, request.file_size, request.content_type)
+        return UploadStatus(chunk_size=CHUNK_SIZE, **state)
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.get("/uploads/{upload_id}", response_model=UploadStatus)
+def upload_status(upload_id: str):
+    """Get how many bytes of a resumable upload have been received"""
+    try:
+        return UploadStatus(chunk_size=CHUNK_SIZE, **get_upload_status(INCOMPLETE_UPLOADS_DIR, upload_id))
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.put("/uploads/{upload_id}", response_model=UploadStatus)
+def upload_chunk(upload_id: str, offset: int = Query(..., ge=0), chunk: UploadFile = File(...)):
+    """Append a chunk (at most 8MB) starting at `offset`"""
+    try:
+        state = append_upload_chunk(INCOMPLETE_UPLOADS_DIR, upload_id, offset, chunk.file)
+        return UploadStatus(chunk_size=CHUNK_SIZE, **state)
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/uploads/{upload_id}/complete")
+def finish_upload(upload_id: str, request: UploadCompleteRequest = None):
+    """Verify a fully received upload, then index it like /upload-doc"""
+    try:
+        expected_sha256 = request.sha256 if request else None
+        part_path = new_temp_path(INCOMPLETE_UPLOADS_DIR)
+        try:
+            state, sha256 = complete_upload(INCOMPLETE_UPLOADS_DIR, upload_id, part_path, expected_sha256)
+        except BaseException:
+            os.remove(part_path)
+            raise
+        logging.info(f"Completed resumable upload {upload_id}: {state['filename']} ({state['file_size']} bytes, sha256 {sha256})")
+        return register_and_index_document(part_path, state["filename"], state["file_size"], state["content_type"], sha256)
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Error completing upload {upload_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
+
+@app.delete("/uploads/{upload_id}")
+def cancel_upload(upload_id: str):
+    """Abort a resumable upload and discard the received bytes"""
+    try:
+        abort_upload(INCOMPLETE_UPLOADS_DIR, upload_id)
+        return {"message": f"Upload {upload_id} cancelled"}
+    except UploadValidationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
 @app.post("/delete-doc")
 def delete_document(request: DeleteFileRequest):
     try:
-        chroma_delete_success = delete_doc_from_chroma(request.file_id)
+        # Hold the write lock across both deletes so a reindex swap can't land in between
+        # and carry the document's chunks into the new collection
+        with index_write_lock:
+            file_hash = get_document_hash(request.file_id)
+            chroma_delete_success = delete_doc_from_chroma(request.file_id)
+            db_delete_success = chroma_delete_success and delete_document_record(request.file_id)
+            if db_delete_success:
+                release_parsed_text(file_hash)
 
         if chroma_delete_success:
-            db_delete_success = delete_document_record(request.file_id)
             if db_delete_success:
                 return {"message": f"Successfully deleted document with file_id {request.file_id} from the system."}
             else:
@@ -196,6 +378,29 @@ def delete_document(request: DeleteFileRequest):
         logging.error(f"Error deleting document: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
+def require_admin(x_admin_token):
+    """Admin endpoints are disabled unless ADMIN_TOKEN is set, and then require it in X-Admin-Token"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/reindex", status_code=202)
+def reindex_corpus(request: ReindexRequest = None, x_admin_token: Optional[str] = Header(None)):
+    """Re-chunk and re-embed every document from the parsed-text store into a new collection, then swap it in"""
+    require_admin(x_admin_token)
+    request = request or ReindexRequest()
+    if not start_reindex_job(request.workers, request.keep_old):
+        raise HTTPException(status_code=409, detail="A reindex is already running")
+    logging.info(f"Reindex started (workers={request.workers}, keep_old={request.keep_old})")
+    return get_reindex_status()
+
+@app.get("/admin/reindex")
+def reindex_status(x_admin_token: Optional[str] = Header(None)):
+    """Progress of the current or last reindex"""
+    require_admin(x_admin_token)
+    return get_reindex_status()
+
 if __name__ == "__main__":
     import uvicorn
     print("Starting RAG Chatbot server...")
@@ -22,10 +22,40 @@ class DocumentInfo(BaseModel):
     upload_timestamp: datetime
     file_size: int
     content_type: str
+    chunk_count: int = 0
+    token_count: int = 0
+    indexing_ms: int = 0
 
     class Config:
         # Allow field aliases for frontend compatibility
         from_attributes = True
 
+class CorpusStats(BaseModel):
+    corpus_version: int
+    document_count: int
+    total_file_size: int
+    chunk_count: int
+    token_count: int
+
 class DeleteFileRequest(BaseModel):
     file_id: int
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    file_size: int = Field(description="Total size of the file in bytes")
+    content_type: str = Field(default="application/octet-stream")
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    filename: str
+    file_size: int
+    content_type: str
+    received: int = Field(description="Bytes received so far; the next chunk must start at this offset")
+    chunk_size: int = Field(default=0, description="Recommended chunk size in bytes")
+
+class UploadCompleteRequest(BaseModel):
+    sha256: str = Field(default=None, description="Optional SHA-256 of the whole file, verified before indexing")
+
+class ReindexRequest(BaseModel):
+    workers: int = Field(default=4, ge=1, le=32)
+    keep_old: bool = Field(default=False, description="Keep the previous collection instead of deleting it after the swap")
@@ -0,0 +1,210 @@
+"""Re-chunk and re-embed the whole corpus from the parsed-text store, then swap it in.
+
+Usage:
+    python reindex.py [--workers 4] [--delete-old]
+
+Chunks are rebuilt with the current `text_splitter` and embedding function into a
+new Chroma collection. /chat keeps answering from the old collection until the new
+one is complete, then the active collection is switched atomically.
+
+If any document cannot be rebuilt (for example its stored text and uploaded file
+are both gone), nothing is swapped and the old collection stays active.
+
+The CLI is for offline use only: it refuses to run while the API server is up,
+because the server keeps writing uploads and deletes to the collection it has open
+and would lose them when it next starts on the new collection. While a server is
+running, use POST /admin/reindex instead, which swaps the collection inside the
+server process. A server started while the CLI is running refuses to start.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from chroma_utils import (text_splitter, annotate_splits, load_pages_cached, open_vector_store, swap_vector_store,
+                          index_write_lock, acquire_writer_lock, get_vectorizer_path, SimpleTfidfEmbeddings)
+from db_utils import get_documents_for_reindex, set_document_hash, update_documents_stats
+from text_store import hash_file
+from upload_utils import find_upload_path
+
+DATA_DIR = os.getenv("DATA_DIR", ".")
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+ADD_BATCH_SIZE = 256
+OLD_COLLECTION_GRACE_SECONDS = 30  # let in-flight queries finish before dropping the old collection
+
+# State of the background job started from the admin endpoint
+_job_lock = threading.Lock()
+_job_status = {"state": "idle"}
+
+
+class ReindexError(RuntimeError):
+    """Raised when a reindex is aborted before the swap; the old collection stays active"""
+
+
+def _prepare_document(doc):
+    """Load pages (from the text store when possible) and split them. Returns (doc, splits, ids)."""
+    file_path = find_upload_path(UPLOADS_DIR, doc["id"], doc["filename"])
+    file_hash = doc["file_hash"]
+    if not file_hash:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"No stored text and no uploaded file for {doc['filename']}")
+        # Documents indexed before the text store existed: hash once and backfill
+        file_hash = hash_file(file_path)
+        set_document_hash(doc["id"], file_hash)
+    pages = load_pages_cached(file_path, file_hash)
+    splits = text_splitter.split_documents(pages)
+    ids = annotate_splits(splits, doc["id"], file_path, doc["filename"])
+    return doc, splits, ids
+
+
+def _add_document(vectorstore, doc, splits, ids):
+    """Embed one document into `vectorstore`. Returns its (file_id, chunk_count, token_count, indexing_ms)."""
+    start = time.perf_counter()
+    for i in range(0, len(splits), ADD_BATCH_SIZE):
+        vectorstore.add_documents(splits[i:i + ADD_BATCH_SIZE], ids=ids[i:i + ADD_BATCH_SIZE])
+    return (
+        doc["id"],
+        len(splits),
+        sum(len(split.page_content.split()) for split in splits),
+        int((time.perf_counter() - start) * 1000),
+    )
+
+
+def _prepare_all(docs, workers, failures):
+    prepared = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_prepare_document, doc) for doc in docs]
+        for doc, future in zip(docs, futures):
+            try:
+                prepared.append(future.result())
+            except Exception as e:
+                print(f" Skipping {doc['filename']} (file_id {doc['id']}): {e}")
+                failures.append({"file_id": doc["id"], "filename": doc["filename"], "error": str(e)})
+    return prepared
+
+
+def _check_failures(failures, progress):
+    # Swapping would silently drop these documents from /chat once the old collection is deleted
+    if failures:
+        progress(failures=failures)
+        names = ", ".join(f"{f['filename']} (file_id {f['file_id']})" for f in failures)
+        raise ReindexError(f"{len(failures)} document(s) could not be rebuilt, keeping the current collection: {names}")
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def reindex_corpus(workers=4, keep_old=False, progress=None, grace_seconds=OLD_COLLECTION_GRACE_SECONDS):
+    """Rebuild every chunk and embedding into a new collection and make it active"""
+    progress = progress or (lambda **kwargs: None)
+    started = time.perf_counter()
+    collection_name = f"corpus_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    failures = []
+
+    docs = get_documents_for_reindex()
+    progress(phase="chunking", documents=len(docs), collection=collection_name)
+    prepared = _prepare_all(docs, workers, failures)
+    _check_failures(failures, progress)
+
+    # A fresh embedding function; TF-IDF is fitted on the whole corpus instead of the first upload,
+    # and saved next to the collection so it is reloaded after a restart
+    vectorizer_path = get_vectorizer_path(collection_name)
+    embedding_function = SimpleTfidfEmbeddings(vectorizer_path)
+    embedding_function.fit([split.page_content for _, splits, _ in prepared for split in splits])
+    new_vectorstore = open_vector_store(collection_name, embedding_function)
+
+    try:
+        progress(phase="embedding", documents=len(prepared))
+        # Stats are only written once the swap succeeds, so an aborted run leaves document_store untouched
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            stats = list(pool.map(lambda item: _add_document(new_vectorstore, *item), prepared))
+
+        # Catch up with uploads/deletes that happened while building, then swap under the write lock
+        progress(phase="swapping")
+        with index_write_lock:
+            indexed_ids = {doc["id"] for doc, _, _ in prepared}
+            current = get_documents_for_reindex()
+            current_ids = {doc["id"] for doc in current}
+            for item in _prepare_all([doc for doc in current if doc["id"] not in indexed_ids], workers, failures):
+                stats.append(_add_document(new_vectorstore, *item))
+            _check_failures(failures, progress)
+            for file_id in indexed_ids - current_ids:
+                stale = new_vectorstore.get(where={"file_id": file_id})
+                if stale and stale.get("ids"):
+                    new_vectorstore.delete(ids=stale["ids"])
+            old_vectorstore = swap_vector_store(new_vectorstore, embedding_function, collection_name)
+    except Exception:
+        # The old collection is still active; drop the half-built one
+        new_vectorstore.delete_collection()
+        _remove_file(vectorizer_path)
+        raise
+
+    # The new collection is live; record the stats it was built with (rows deleted meanwhile are skipped)
+    update_documents_stats([row for row in stats if row[0] in current_ids])
+
+    if not keep_old and old_vectorstore is not None:
+        progress(phase="dropping old collection")
+        time.sleep(grace_seconds)
+        try:
+            old_name = old_vectorstore._collection.name
+            old_vectorstore.delete_collection()
+            _remove_file(get_vectorizer_path(old_name))
+        except Exception as e:
+            print(f" Could not delete previous collection: {e}")
+
+    return {
+        "collection": collection_name,
+        "documents": len(current_ids),
+        "chunks": new_vectorstore._collection.count(),
+        "failures": failures,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def get_reindex_status():
+    with _job_lock:
+        return dict(_job_status)
+
+
+def start_reindex_job(workers=4, keep_old=False):
+    """Run reindex_corpus in a background thread. Returns False if one is already running."""
+    with _job_lock:
+        if _job_status.get("state") == "running":
+            return False
+        _job_status.clear()
+        _job_status.update({"state": "running", "started_at": str(datetime.now())})
+
+    def progress(**kwargs):
+        with _job_lock:
+            _job_status.update(kwargs)
+
+    def run():
+        try:
+            result = reindex_corpus(workers, keep_old, progress)
+            progress(state="done", finished_at=str(datetime.now()), result=result)
+        except Exception as e:
+            print(f" Reindex failed: {e}")
+            progress(state="failed", finished_at=str(datetime.now()), error=str(e))
+
+    threading.Thread(target=run, name="reindex", daemon=True).start()
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--delete-old", action="store_true",
+                        help="Delete the previous collection once the new one is active")
+    args = parser.parse_args()
+    if not acquire_writer_lock():
+        sys.exit("The API server (or another reindex) is using the vector store. "
+                 "Stop it first, or use POST /admin/reindex while it is running.")
+    print(reindex_corpus(args.workers, keep_old=not args.delete_old,
+                         progress=lambda **kwargs: print(kwargs), grace_seconds=0))
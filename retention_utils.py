@@ -0,0 +1,164 @@
+"""Chat log retention: archive idle sessions, compact long ones and return freed pages to the OS.
+
+Usage:
+    python retention_utils.py [--enable-incremental-vacuum] [--step]
+
+Databases created before incremental auto_vacuum was enabled need a one-off full
+VACUUM to switch over. That rewrites the whole file and blocks writes while it runs,
+so it is never done by the background worker; run it here with --enable-incremental-vacuum
+while the API server is stopped or quiet.
+"""
+import argparse
+import os
+import threading
+import time
+from db_utils import get_db_connection, encode_archive_payload
+
+# Sessions with no new turns for this many days are moved entirely into the archive
+HOT_SESSION_DAYS = float(os.getenv("RETENTION_HOT_DAYS", "30"))
+# Long sessions keep only their most recent turns in application_logs
+HOT_TURNS_PER_SESSION = int(os.getenv("RETENTION_HOT_TURNS", "100"))
+# Maintenance only runs after the API has been idle this long
+IDLE_SECONDS = float(os.getenv("RETENTION_IDLE_SECONDS", "30"))
+INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "60"))
+SESSIONS_PER_STEP = 200  # sessions archived per maintenance step, keeping write locks short
+VACUUM_PAGES_PER_STEP = 2000  # free pages returned to the OS per step
+
+_last_activity = time.monotonic()
+_worker = None
+_vacuum_hint_shown = False
+
+
+def mark_activity():
+    """Record that a request is being served, postponing maintenance"""
+    global _last_activity
+    _last_activity = time.monotonic()
+
+
+def is_idle():
+    return time.monotonic() - _last_activity >= IDLE_SECONDS
+
+
+def archive_session_turns(conn, session_id, keep_last=0):
+    """Move all but the newest `keep_last` turns of a session into one compressed archive segment.
+
+    Runs in its own transaction. Returns the number of turns archived.
+    """
+    rows = conn.execute('''SELECT id, user_query, gpt_response, model, created_at FROM application_logs
+                           WHERE session_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?''',
+                        (session_id, keep_last)).fetchall()
+    if not rows:
+        return 0
+    rows = [tuple(row) for row in reversed(rows)]
+    with conn:
+        conn.execute('''INSERT INTO application_logs_archive
+                        (session_id, first_log_id, last_log_id, turn_count, first_at, last_at, payload)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (session_id, rows[0][0], rows[-1][0], len(rows), rows[0][4], rows[-1][4],
+                      encode_archive_payload(rows)))
+        conn.execute('DELETE FROM application_logs WHERE session_id = ? AND id <= ?', (session_id, rows[-1][0]))
+        conn.execute('UPDATE chat_sessions SET archived_turns = archived_turns + ? WHERE session_id = ?',
+                     (len(rows), session_id))
+    return len(rows)
+
+
+def archive_idle_sessions(conn, limit=SESSIONS_PER_STEP):
+    """Archive every hot turn of sessions that have been inactive for HOT_SESSION_DAYS"""
+    sessions = conn.execute('''SELECT session_id FROM chat_sessions
+                               WHERE last_at < datetime('now', ?) AND turn_count > archived_turns
+                               ORDER BY last_at LIMIT ?''',
+                            (f'-{HOT_SESSION_DAYS} days', limit)).fetchall()
+    return sum(archive_session_turns(conn, row['session_id']) for row in sessions)
+
+
+def compact_long_sessions(conn, limit=SESSIONS_PER_STEP):
+    """Keep active sessions small by archiving turns beyond the newest HOT_TURNS_PER_SESSION"""
+    # Only compact once a session is 25% over the limit, so each segment holds a useful batch
+    sessions = conn.execute('''SELECT session_id FROM chat_sessions
+                               WHERE turn_count - archived_turns > ?
+                               LIMIT ?''',
+                            (HOT_TURNS_PER_SESSION + HOT_TURNS_PER_SESSION // 4, limit)).fetchall()
+    return sum(archive_session_turns(conn, row['session_id'], HOT_TURNS_PER_SESSION) for row in sessions)
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES_PER_STEP):
+    """Return up to `pages` free pages to the OS. Does nothing unless auto_vacuum is INCREMENTAL."""
+    global _vacuum_hint_shown
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        if not _vacuum_hint_shown:
+            _vacuum_hint_shown = True
+            print("Chat log retention: incremental vacuum is off for this database; "
+                  "run `python retention_utils.py --enable-incremental-vacuum` while the server is stopped")
+        return 0
+    free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    return free_before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def enable_incremental_vacuum():
+    """Switch an existing database to incremental auto_vacuum with a one-off full VACUUM.
+
+    Rewrites the whole database and holds the write lock until done. Returns True
+    if a conversion was needed.
+    """
+    conn = get_db_connection()
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        # Changing auto_vacuum on an existing database only takes effect after a full VACUUM
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+    finally:
+        conn.close()
+
+
+def run_maintenance_step():
+    """One bounded round of archiving, compaction and vacuuming"""
+    conn = get_db_connection()
+    try:
+        stats = {
+            "archived_idle_turns": archive_idle_sessions(conn),
+            "compacted_turns": compact_long_sessions(conn),
+        }
+        stats["vacuumed_pages"] = incremental_vacuum(conn)
+        return stats
+    finally:
+        conn.close()
+
+
+def _worker_loop():
+    while True:
+        time.sleep(INTERVAL_SECONDS)
+        if not is_idle():
+            continue
+        try:
+            stats = run_maintenance_step()
+            if any(stats.values()):
+                print(f"Chat log retention: {stats}")
+        except Exception as e:
+            print(f" Chat log retention step failed: {e}")
+
+
+def start_retention_worker():
+    """Start the background thread that runs maintenance while the API is idle"""
+    global _worker
+    if _worker is None:
+        _worker = threading.Thread(target=_worker_loop, name="retention", daemon=True)
+        _worker.start()
+    return _worker
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="One-off full VACUUM that switches an existing database to incremental auto_vacuum")
+    parser.add_argument("--step", action="store_true", help="Run one maintenance step now")
+    args = parser.parse_args()
+    if args.enable_incremental_vacuum:
+        start = time.perf_counter()
+        converted = enable_incremental_vacuum()
+        print(f"Incremental auto_vacuum {'enabled' if converted else 'was already enabled'} "
+              f"({time.perf_counter() - start:.1f}s)")
+    if args.step:
+        print(run_maintenance_step())
@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+import hashlib
+import tempfile
+import unicodedata
+from typing import List, Optional
+from langchain_core.documents import Document
+
+DATA_DIR = os.getenv("DATA_DIR", ".")
+TEXT_STORE_DIR = os.path.join(DATA_DIR, "text_store")
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file, read in 1MB chunks"""
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    """Normalize extracted page text so re-chunking is independent of the parser's quirks"""
+    text = unicodedata.normalize("NFC", text).replace("\x00", "")
+    lines = [line.rstrip() for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    return "\n".join(lines).strip()
+
+
+def _store_path(file_hash: str) -> str:
+    return os.path.join(TEXT_STORE_DIR, file_hash[:2], f"{file_hash}.json.gz")
+
+
+def has_pages(file_hash: str) -> bool:
+    return bool(file_hash) and os.path.exists(_store_path(file_hash))
+
+
+def save_pages(file_hash: str, pages: List[Document]) -> None:
+    """Store parsed pages (text + loader metadata) gzip-compressed under the file's hash"""
+    path = _store_path(file_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = [{"page_content": page.page_content, "metadata": page.metadata} for page in pages]
+    # A unique temp file per call: threads saving the same hash must not share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_pages(file_hash: str) -> Optional[List[Document]]:
+    """Return the stored pages for a file hash, or None if the file was never parsed"""
+    if not has_pages(file_hash):
+        return None
+    try:
+        with gzip.open(_store_path(file_hash), "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable text store entry {file_hash}: {e}")
+        return None
+    return [Document(page_content=page["page_content"], metadata=page["metadata"]) for page in payload]
+
+
+def delete_pages(file_hash: str) -> None:
+    """Remove the stored pages for a file hash, if any"""
+    try:
+        os.remove(_store_path(file_hash))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+ALLOWED_EXTENSIONS = ['.pdf', '.docx', '.html']
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(10 * 1024 * 1024)))  # 10MB
+CHUNK_SIZE = 1024 * 1024  # 1MB read/write chunks
+MAX_PART_SIZE = 8 * 1024 * 1024  # largest chunk accepted by a single resumable PUT
+HEAD_BYTES = 512  # bytes inspected for magic-byte detection
+STALE_UPLOAD_SECONDS = 24 * 60 * 60
+
+# In-memory hash state for resumable uploads; rebuilt from the .part file after a restart
+_upload_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class UploadValidationError(ValueError):
+    """Raised when an upload is rejected (bad type, too large, wrong offset...)"""
+
+    def __init__(self, detail, status_code=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def validate_filename(filename):
+    """Check the extension and return a safe base filename"""
+    if not filename:
+        raise UploadValidationError("No file provided")
+    filename = os.path.basename(filename)
+    file_extension = os.path.splitext(filename)[1].lower()
+    if file_extension not in ALLOWED_EXTENSIONS:
+        raise UploadValidationError(f"File type {file_extension} not supported. Allowed: {ALLOWED_EXTENSIONS}")
+    return filename
+
+
+def check_size(size, max_size=MAX_UPLOAD_SIZE):
+    if size > max_size:
+        raise UploadValidationError(f"File too large. Maximum size: {max_size // (1024*1024)}MB", status_code=413)
+
+
+def matches_file_type(head: bytes, extension: str) -> bool:
+    """Check the first bytes of a file against the signature expected for its extension"""
+    if extension == '.pdf':
+        return head.startswith(b'%PDF-')
+    if extension == '.docx':
+        # DOCX is a ZIP container
+        return head.startswith(b'PK\x03\x04')
+    if extension == '.html':
+        text = head.lstrip(b'\xef\xbb\xbf').lstrip()
+        return b'\x00' not in head and text.startswith(b'<')
+    return False
+
+
+def check_file_type(head, filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if not matches_file_type(head, extension):
+        raise UploadValidationError(f"File content does not look like a {extension} file")
+
+
+def new_temp_path(directory):
+    """Create an empty, uniquely named .part file in `directory` and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, prefix="upload-", suffix=".part")
+    os.close(fd)
+    return path
+
+
+def stored_upload_path(uploads_dir, file_id, filename):
+    """Where an indexed document's file lives; the file_id prefix keeps same-name uploads apart"""
+    return os.path.join(uploads_dir, f"{file_id}_{filename}")
+
+
+def find_upload_path(uploads_dir, file_id, filename):
+    """Path of a document's uploaded file, falling back to the bare filename used before file_id prefixes"""
+    path = stored_upload_path(uploads_dir, file_id, filename)
+    if os.path.exists(path):
+        return path
+    return os.path.join(uploads_dir, filename)
+
+
+def stream_to_disk(fileobj, directory, filename, max_size=MAX_UPLOAD_SIZE):
+    """Copy `fileobj` into a new temporary file in `directory` (swept by cleanup_stale_uploads), validating type and size as bytes arrive.
+
+    The first chunk is checked for the expected magic bytes before anything is
+    written. Every upload gets its own uniquely named .part file, which the
+    caller moves into place once the document is registered. Returns
+    (part_path, file_size, sha256 hexdigest).
+    """
+    first_chunk = fileobj.read(CHUNK_SIZE)
+    check_file_type(first_chunk[:HEAD_BYTES], filename)
+
+    part_path = new_temp_path(directory)
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, "wb") as buffer:
+            chunk = first_chunk
+            while chunk:
+                size += len(chunk)
+                check_size(size, max_size)
+                hasher.update(chunk)
+                buffer.write(chunk)
+                chunk = fileobj.read(CHUNK_SIZE)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return part_path, size, hasher.hexdigest()
+
+
+# Resumable uploads: state lives in <sessions_dir>/<upload_id>.json next to <upload_id>.part
+
+def _session_paths(sessions_dir, upload_id):
+    try:
+        upload_id = uuid.UUID(upload_id).hex
+    except ValueError:
+        raise UploadValidationError("Unknown upload_id", status_code=404)
+    base = os.path.join(sessions_dir, upload_id)
+    return base + ".json", base + ".part"
+
+
+def _save_state(state_path, state):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _get_session(sessions_dir, upload_id):
+    """Load session state and its in-memory hasher, rebuilding the hash if needed"""
+    state_path, part_path = _session_paths(sessions_dir, upload_id)
+    with _sessions_lock:
+        session = _upload_sessions.get(state_path)
+        if session is not None:
+            return session
+        if not os.path.exists(state_path):
+            raise UploadValidationError("Unknown upload_id", status_code=404)
+        with open(state_path) as f:
+            state = json.load(f)
+        hasher = hashlib.sha256()
+        with open(part_path, "r+b") as f:
+            # Drop any bytes past the last acknowledged offset (e.g. a write interrupted by a crash)
+            f.truncate(state["received"])
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        session = {"state": state, "hasher": hasher, "lock": threading.Lock(),
+                   "state_path": state_path, "part_path": part_path}
+        _upload_sessions[state_path] = session
+        return session
+
+
+def _drop_session(session):
+    with _sessions_lock:
+        _upload_sessions.pop(session["state_path"], None)
+    for path in (session["state_path"], session["part_path"]):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def cleanup_stale_uploads(sessions_dir, max_age=STALE_UPLOAD_SECONDS):
+    """Remove resumable uploads, and temp files orphaned by a crash, untouched for `max_age` seconds"""
+    now = time.time()
+    for name in os.listdir(sessions_dir):
+        path = os.path.join(sessions_dir, name)
+        try:
+            if now - os.path.getmtime(path) < max_age:
+                continue
+            if name.endswith(".json"):
+                _drop_session({"state_path": path, "part_path": path[:-len(".json")] + ".part"})
+            elif name.startswith("upload-") and name.endswith(".part"):
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def create_upload_session(sessions_dir, filename, file_size, content_type="application/octet-stream"):
+    """Start a resumable upload after validating the declared name and size"""
+    filename = validate_filename(filename)
+    check_size(file_size)
+    if file_size <= 0:
+        raise UploadValidationError("file_size must be positive")
+    os.makedirs(sessions_dir, exist_ok=True)
+    cleanup_stale_uploads(sessions_dir)
+
+    upload_id = uuid.uuid4().hex
+    state_path, part_path = _session_paths(sessions_dir, upload_id)
+    state = {
+        "upload_id": upload_id,
+        "filename": filename,
+        "file_size": file_size,
+        "content_type": content_type or "application/octet-stream",
+        "received": 0,
+        "created_at": time.time(),
+    }
+    open(part_path, "wb").close()
+    _save_state(state_path, state)
+    return state
+
+
+def get_upload_status(sessions_dir, upload_id):
+    return dict(_get_session(sessions_dir, upload_id)["state"])
+
+
+def append_upload_chunk(sessions_dir, upload_id, offset, fileobj):
+    """Append one chunk at `offset`. Returns the updated session state.
+
+    A mismatched offset is rejected with 409 so the client can re-sync from
+    `received` and resume instead of restarting the whole upload.
+    """
+    session = _get_session(sessions_dir, upload_id)
+    with session["lock"]:
+        state = session["state"]
+        if offset != state["received"]:
+            raise UploadValidationError(f"Expected offset {state['received']}, got {offset}", status_code=409)
+
+        part_hasher = session["hasher"].copy()
+        written = 0
+        with open(session["part_path"], "r+b") as buffer:
+            buffer.seek(offset)
+            try:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                    written += len(chunk)
+                    if written > MAX_PART_SIZE:
+                        raise UploadValidationError(f"Chunk too large. Maximum chunk size: {MAX_PART_SIZE // (1024*1024)}MB", status_code=413)
+                    if offset + written > state["file_size"]:
+                        raise UploadValidationError("Chunk goes past the declared file_size", status_code=413)
+                    if offset == 0 and written == len(chunk):
+                        # Reject a bad file on its first chunk, before the rest is sent
+                        check_file_type(chunk[:HEAD_BYTES], state["filename"])
+                    part_hasher.update(chunk)
+                    buffer.write(chunk)
+            except BaseException:
+                # Discard the partial chunk; the client retries from the last acknowledged offset
+                buffer.truncate(offset)
+                raise
+            buffer.truncate(offset + written)
+
+        session["hasher"] = part_hasher
+        state["received"] = offset + written
+        _save_state(session["state_path"], state)
+        return dict(state)
+
+
+def complete_upload(sessions_dir, upload_id, file_path, expected_sha256=None):
+    """Move a fully received upload to `file_path`. Returns (state, sha256 hexdigest)."""
+    session = _get_session(sessions_dir, upload_id)
+    with session["lock"]:
+        state = session["state"]
+        if state["received"] != state["file_size"]:
+            raise UploadValidationError(f"Upload incomplete: received {state['received']} of {state['file_size']} bytes", status_code=409)
+        sha256 = session["hasher"].hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            _drop_session(session)
+            raise UploadValidationError("SHA-256 mismatch; upload discarded")
+        os.replace(session["part_path"], file_path)
+        _drop_session(session)
+        return dict(state), sha256
+
+
+def abort_upload(sessions_dir, upload_id):
+    session = _get_session(sessions_dir, upload_id)
+    with session["lock"]:
+        _drop_session(session)